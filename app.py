@@ -1,12 +1,78 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from decimal import Decimal
+from typing import Any, Optional
+import anyio
+import orjson
+import pyarrow as pa
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from sap_query_assistant import SAPQueryAssistant, QueryResponse
+from hana_pool import HanaConnectionPool
+from query_cache import RedisCache, create_redis_client
+from rate_limit import OpenAIRateLimiter
+from sap_query_assistant import SAPQueryAssistant, QueryResponse, create_openai_client
+
+def _orjson_default(obj: Any) -> Any:
+    """Serialize HANA result types that orjson does not handle natively (it already covers dates and times)."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, bytes):
+        return obj.decode(errors="replace")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dump_json(content: Any) -> bytes:
+    """Serialize content to JSON with orjson."""
+    return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+class HanaJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, including the Decimal and binary values HANA returns."""
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+def arrow_response(result: QueryResponse, table: Optional[pa.Table]) -> Response:
+    """Serialize results as an Arrow IPC stream, carrying the other response fields as schema metadata."""
+    if table is None:
+        table = pa.table({})
+    table = table.replace_schema_metadata({
+        "sqlQuery": result.sqlQuery,
+        "visualizationType": result.visualizationType,
+        "summary": result.summary,
+        "error": result.error or ""
+    })
+    
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(sink.getvalue().to_pybytes(), media_type=ARROW_STREAM_MEDIA_TYPE)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create clients shared by all requests for the lifetime of the worker."""
+    # One client per worker keeps its HTTP connection pool and TLS sessions warm
+    app.state.openai = create_openai_client()
+    # Bounds concurrent OpenAI calls across all requests in this worker
+    app.state.openai_limiter = OpenAIRateLimiter.from_env()
+    app.state.hana_pool = HanaConnectionPool.from_env()
+    # Generated SQL is cached in Redis for a day when REDIS_URL is configured
+    app.state.redis = create_redis_client()
+    app.state.sql_cache = RedisCache(app.state.redis, "sql", ttl=86400) if app.state.redis is not None else None
+    # Blocking HANA queries run in anyio's threadpool; raise its default 40-thread cap
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 64
+    yield
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+    app.state.hana_pool.close()
+    await app.state.openai.close()
 
 app = FastAPI(
     title="SAP HANA B1 Query Assistant",
     description="AI-powered assistant that translates natural language questions into SAP HANA B1 SQL queries",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=HanaJSONResponse
 )
 
 # Configure CORS
@@ -22,29 +88,92 @@ class QueryRequest(BaseModel):
     query: str
     execute_query: bool = True
 
-@app.post("/query", response_model=QueryResponse)
-async def process_query(request: QueryRequest):
+@app.post(
+    "/query",
+    response_model=QueryResponse,
+    responses={200: {"content": {ARROW_STREAM_MEDIA_TYPE: {}}}}
+)
+async def process_query(request: QueryRequest, http_request: Request):
     """
     Process a natural language query and return structured response.
     
+    Clients that send `Accept: application/vnd.apache.arrow.stream` receive the results as an
+    Arrow IPC stream instead, with the other response fields in the schema metadata.
+    
     Args:
         request (QueryRequest): Natural language business query and execution flag
+        http_request (Request): Incoming request, used to reach the shared clients and Accept header
         
     Returns:
         QueryResponse: Structured response containing SQL query, visualization type, summary, and results
     """
     try:
-        assistant = SAPQueryAssistant()
-        result = assistant.process_query(request.query, execute_query=request.execute_query)
-        return result
+        assistant = SAPQueryAssistant(
+            client=http_request.app.state.openai,
+            hana_pool=http_request.app.state.hana_pool,
+            sql_cache=http_request.app.state.sql_cache,
+            rate_limiter=http_request.app.state.openai_limiter
+        )
+        if request.execute_query and ARROW_STREAM_MEDIA_TYPE in http_request.headers.get("accept", ""):
+            # Columnar results skip building a dict per row and the JSON encoding of every cell
+            result, table = await assistant.process_query_arrow(request.query)
+            return arrow_response(result, table)
+        
+        result = await assistant.process_query(request.query, execute_query=request.execute_query)
+        # Serialize directly; re-validating and encoding large result sets through the response model is slow
+        return HanaJSONResponse(result.dict())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def stream_query(request: QueryRequest, http_request: Request):
+    """
+    Process a natural language query and stream the response as server-sent events.
+    
+    Args:
+        request (QueryRequest): Natural language business query and execution flag
+        http_request (Request): Incoming request, used to reach the shared clients
+        
+    Returns:
+        StreamingResponse: text/event-stream of token, reset, sql, visualization, summary, results, error and done events
+    """
+    assistant = SAPQueryAssistant(
+        client=http_request.app.state.openai,
+        hana_pool=http_request.app.state.hana_pool,
+        sql_cache=http_request.app.state.sql_cache,
+        rate_limiter=http_request.app.state.openai_limiter
+    )
+    
+    async def events():
+        try:
+            async for event, data in assistant.stream_query(request.query, execute_query=request.execute_query):
+                yield f"event: {event}\ndata: {dump_json(data).decode()}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {dump_json(f'Error processing query: {str(e)}').decode()}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
     return {"status": "healthy"}
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # Requests mostly wait on OpenAI and HANA, so run more workers than cores;
+    # set REDIS_URL so the generated-SQL cache is shared between them.
+    # The HANA pool, OpenAI concurrency and limit_concurrency all apply per worker.
+    workers = int(os.getenv("WEB_CONCURRENCY") or 2 * (os.cpu_count() or 1))
+    # Multiple workers need an import string so each process can load the app itself
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+        backlog=2048,
+        limit_concurrency=1024,
+        timeout_keep_alive=30
+    ) 
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+from hdbcli import dbapi
+
+
+class HanaConnectionPool:
+    def __init__(self, db_params: Dict[str, Any], maxsize: int = 20, timeout: float = 30.0):
+        """
+        Initialize a bounded pool of SAP HANA connections.
+
+        Args:
+            db_params (dict): Keyword arguments passed to dbapi.connect
+            maxsize (int): Maximum number of open connections in this process (each API worker has its own pool)
+            timeout (float): Seconds to wait for a free connection when the pool is exhausted
+        """
+        self.db_params = db_params
+        self.maxsize = maxsize
+        self.timeout = timeout
+        # LIFO so the most recently used (warmest) connection is handed out first
+        self._idle = queue.LifoQueue(maxsize=maxsize)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @classmethod
+    def from_env(cls) -> "HanaConnectionPool":
+        """Create a pool from the SAP_HANA_* environment variables."""
+        db_params = {
+            "address": os.getenv("SAP_HANA_HOST"),
+            "port": int(os.getenv("SAP_HANA_PORT", "39015")),
+            "user": os.getenv("SAP_HANA_USER"),
+            "password": os.getenv("SAP_HANA_PASSWORD"),
+            "database": os.getenv("SAP_HANA_DATABASE")
+        }
+        return cls(db_params, maxsize=int(os.getenv("SAP_HANA_POOL_SIZE") or "20"))
+
+    def _connect(self):
+        """Open a new database connection."""
+        try:
+            return dbapi.connect(**self.db_params)
+        except Exception as e:
+            raise Exception(f"Failed to connect to SAP HANA database: {str(e)}")
+
+    @staticmethod
+    def _is_alive(conn) -> bool:
+        """Check that a pooled connection still works before handing it out."""
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1 FROM DUMMY")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn) -> None:
+        """Close a connection and free its slot in the pool."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def acquire(self):
+        """Check out a live connection, opening a new one while below maxsize."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = not self._closed and self._created < self.maxsize
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise Exception("Timed out waiting for a SAP HANA connection")
+
+            if self._is_alive(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn) -> None:
+        """Return a connection to the pool."""
+        if self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Check out a connection for the duration of a with block."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        """Close all idle connections; checked-out ones are closed when released."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
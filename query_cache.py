@@ -0,0 +1,248 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import redis.asyncio as redis
+from cachetools import TTLCache
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# (sqlQuery, visualizationType, summary) - results are never cached since they go stale
+CachedResponse = Tuple[str, str, str]
+
+# Words that change which rows a question asks for without changing its embedding much
+_NUMBER_WORDS = (
+    "one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|fifteen|twenty|thirty|forty|fifty"
+    "|hundred|thousand|million|dozen|half|quarter"
+)
+_DIRECTION_WORDS = (
+    "top|bottom|highest|lowest|best|worst|most|least|largest|smallest|first|last|this|next|previous|current"
+    "|ascending|descending"
+)
+
+# Values copied verbatim into the generated SQL: quoted strings, numbers and codes such as C001,
+# plus number and direction words ("top five", "last year")
+_LITERAL_PATTERN = re.compile(
+    rf"'[^']*'|\"[^\"]*\"|(?i:\b(?:{_NUMBER_WORDS}|{_DIRECTION_WORDS})\b)|\b\w*\d\w*\b|\b[A-Z]{{2,}}\b"
+)
+_KEYWORD_PATTERN = re.compile(rf"(?:{_NUMBER_WORDS}|{_DIRECTION_WORDS})", re.IGNORECASE)
+
+
+def query_literals(query: str) -> Tuple[str, ...]:
+    """Return the literal values in a question, in order, for comparing otherwise similar questions."""
+    # Number and direction words are case-insensitive; quoted strings and codes are not
+    return tuple(
+        literal.lower() if _KEYWORD_PATTERN.fullmatch(literal) else literal
+        for literal in _LITERAL_PATTERN.findall(query)
+    )
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 10_000, ttl: float = 3600):
+        """Initialize a thread-safe exact-match cache of generated query artifacts."""
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # FastAPI may serve requests from a threadpool, and TTLCache is not thread-safe
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query: str, execute_query: bool, schema: str) -> str:
+        """Build the cache key for a natural language query."""
+        digest = hashlib.blake2b(query.strip().lower().encode()).hexdigest()
+        return f"{schema}:{int(execute_query)}:{digest}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Return the cached artifacts for a key, or None on a miss."""
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key: str, value: CachedResponse) -> None:
+        """Store the generated artifacts for a key."""
+        with self._lock:
+            self._cache[key] = value
+
+
+class _EmbeddingIndex:
+    def __init__(self, dim: int, maxsize: int):
+        """Initialize a bounded matrix of unit-length query embeddings, bucketed by their literals."""
+        self._dim = dim
+        self._maxsize = maxsize
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._values: List[CachedResponse] = []
+        # Bucket of each row, so a search can mask out entries whose literals differ
+        self._buckets = np.empty(0, dtype=np.int64)
+        self._row_literals: List[Tuple[str, ...]] = []
+        # literals -> [bucket id, number of rows in the bucket]
+        self._bucket_ids: Dict[Tuple[str, ...], List[int]] = {}
+        self._next_bucket = 0
+        # Next slot to overwrite once the index is full (oldest entry first)
+        self._next = 0
+
+    def _bucket(self, literals: Tuple[str, ...]) -> int:
+        """Return the bucket id for a literals key, creating it if needed, and count one more row in it."""
+        bucket = self._bucket_ids.get(literals)
+        if bucket is None:
+            bucket = self._bucket_ids[literals] = [self._next_bucket, 0]
+            self._next_bucket += 1
+        bucket[1] += 1
+        return bucket[0]
+
+    def _release_bucket(self, literals: Tuple[str, ...]) -> None:
+        """Count one row less in a bucket, dropping the bucket once it is empty."""
+        bucket = self._bucket_ids[literals]
+        bucket[1] -= 1
+        if not bucket[1]:
+            del self._bucket_ids[literals]
+
+    def add(self, vector: np.ndarray, literals: Tuple[str, ...], value: CachedResponse) -> None:
+        """Insert a normalized embedding, evicting the oldest entry when full."""
+        size = len(self._values)
+        if size < self._maxsize:
+            if size == self._vectors.shape[0]:
+                # Grow geometrically to keep inserts amortized O(1)
+                capacity = min(max(2 * size, 64), self._maxsize)
+                grown = np.empty((capacity, self._dim), dtype=np.float32)
+                grown[:size] = self._vectors[:size]
+                self._vectors = grown
+                buckets = np.empty(capacity, dtype=np.int64)
+                buckets[:size] = self._buckets[:size]
+                self._buckets = buckets
+            slot = size
+            self._values.append(value)
+            self._row_literals.append(literals)
+        else:
+            slot = self._next
+            self._release_bucket(self._row_literals[slot])
+            self._values[slot] = value
+            self._row_literals[slot] = literals
+            self._next = (self._next + 1) % self._maxsize
+        self._vectors[slot] = vector
+        self._buckets[slot] = self._bucket(literals)
+
+    def search(self, vector: np.ndarray, literals: Tuple[str, ...]) -> Tuple[float, Optional[CachedResponse]]:
+        """Return the best cosine similarity among entries with the same literals, and its cached value."""
+        # "top 5" and "top 10" embed almost identically but need different SQL
+        bucket = self._bucket_ids.get(literals)
+        if bucket is None:
+            return -1.0, None
+        size = len(self._values)
+        # Vectors are pre-normalized, so cosine similarity is a single matrix-vector product
+        scores = self._vectors[:size] @ vector
+        scores = np.where(self._buckets[:size] == bucket[0], scores, -np.inf)
+        best = int(np.argmax(scores))
+        return float(scores[best]), self._values[best]
+
+
+class SemanticCache:
+    def __init__(self, threshold: float = 0.92, maxsize: int = 10_000):
+        """Initialize a cache that matches paraphrased queries by embedding similarity."""
+        self.threshold = threshold
+        self.maxsize = maxsize
+        # One index per schema so generated SQL never leaks across schemas
+        self._indexes: Dict[str, _EmbeddingIndex] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> Optional[np.ndarray]:
+        """Convert an embedding to a unit-length float32 vector."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        return vector / norm
+
+    def lookup(self, namespace: str, query: str, embedding: Sequence[float]) -> Optional[CachedResponse]:
+        """Return the artifacts of the most similar cached query above the threshold with the same literals."""
+        vector = self._normalize(embedding)
+        if vector is None:
+            return None
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                return None
+            score, value = index.search(vector, query_literals(query))
+        return value if score >= self.threshold else None
+
+    def add(self, namespace: str, query: str, embedding: Sequence[float], value: CachedResponse) -> None:
+        """Store the artifacts generated for a query and its embedding."""
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = _EmbeddingIndex(vector.shape[0], self.maxsize)
+            index.add(vector, query_literals(query), value)
+
+
+# Quoted literals are kept verbatim; they end up in the SQL as written
+_QUOTED_PATTERN = re.compile(r"('[^']*'|\"[^\"]*\")")
+# Sentence punctuation only: operators, signs and % change the question ("> 1000" vs "< 1000"),
+# and a period or colon between digits is part of a number or time
+_SENTENCE_PUNCTUATION = re.compile(r"[?!,;]|[.:](?!\d)")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a question so trivially different phrasings share a cache key."""
+    parts = _QUOTED_PATTERN.split(query)
+    # split() with a capturing group puts the quoted literals at the odd positions
+    normalized = [
+        part if i % 2 else _SENTENCE_PUNCTUATION.sub(" ", part.lower())
+        for i, part in enumerate(parts)
+    ]
+    return " ".join("".join(normalized).split())
+
+
+def create_redis_client() -> Optional["redis.Redis"]:
+    """Create a Redis client from REDIS_URL, or return None when no Redis is configured."""
+    url = os.getenv("REDIS_URL")
+    if not url:
+        return None
+    return redis.from_url(url)
+
+
+class RedisCache:
+    def __init__(self, client: "redis.Redis", prefix: str, ttl: int):
+        """
+        Initialize a persistent cache of generated query artifacts backed by Redis.
+
+        Args:
+            client (redis.Redis): Shared asyncio Redis client
+            prefix (str): Namespace prepended to every key
+            ttl (int): Seconds before an entry expires
+        """
+        self._client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(query: str, schema: str, model: str) -> str:
+        """Build the cache key for a question generated against a schema with a model."""
+        digest = hashlib.sha256(f"{normalize_query(query)}|{schema}|{model}".encode()).hexdigest()
+        return f"{schema}:{digest}"
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        """Return the cached artifacts for a key, or None on a miss or Redis failure."""
+        try:
+            raw = await self._client.get(f"{self.prefix}:{key}")
+        except RedisError as e:
+            # The cache is an optimization; never fail a request because Redis is down
+            logger.warning("Redis cache lookup failed: %s", e)
+            return None
+        if raw is None:
+            return None
+
+        sql_query, viz_type, summary = json.loads(raw)
+        return sql_query, viz_type, summary
+
+    async def set(self, key: str, value: CachedResponse) -> None:
+        """Store the generated artifacts for a key with the configured TTL."""
+        try:
+            await self._client.setex(f"{self.prefix}:{key}", self.ttl, json.dumps(value))
+        except RedisError as e:
+            logger.warning("Redis cache store failed: %s", e)
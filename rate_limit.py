@@ -0,0 +1,79 @@
+import asyncio
+import os
+import re
+import time
+from typing import Dict, Mapping, Optional
+
+# Durations in OpenAI's x-ratelimit-reset-* headers, e.g. "20ms", "1s", "6m0s"
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value: Optional[str]) -> float:
+    """Convert an OpenAI rate limit reset duration to seconds."""
+    if not value:
+        return 0.0
+    return sum(float(amount) * _DURATION_SECONDS[unit] for amount, unit in _DURATION_PART.findall(value))
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> float:
+    """Return the delay in seconds requested by the retry-after-ms or retry-after header, or 0."""
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            delay = float(headers.get(name, "")) * scale
+        except ValueError:
+            continue
+        if delay > 0:
+            return delay
+    return 0.0
+
+
+class OpenAIRateLimiter:
+    def __init__(self, max_concurrency: int = 16, min_remaining_tokens: int = 4000):
+        """
+        Initialize a limiter that bounds in-flight OpenAI calls and pauses before a model's token budget runs out.
+
+        Args:
+            max_concurrency (int): Maximum number of concurrent OpenAI requests in this process (each API worker has its own limiter)
+            min_remaining_tokens (int): Pause new requests to a model until its token window resets below this budget
+        """
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.min_remaining_tokens = min_remaining_tokens
+        # OpenAI enforces token limits per model, so a drained model must not pause the others
+        self._resume_at: Dict[str, float] = {}
+
+    @classmethod
+    def from_env(cls) -> "OpenAIRateLimiter":
+        """Create a limiter from OPENAI_MAX_CONCURRENCY and OPENAI_MIN_REMAINING_TOKENS."""
+        return cls(
+            max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY") or "16"),
+            min_remaining_tokens=int(os.getenv("OPENAI_MIN_REMAINING_TOKENS") or "4000")
+        )
+
+    async def acquire(self, model: str) -> None:
+        """Wait out any pause for the model, then take one of the concurrent request slots."""
+        # Wait before taking a slot so a paused model does not hold slots other models could use
+        delay = self._resume_at.get(model, 0.0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._semaphore.acquire()
+
+    def release(self) -> None:
+        """Free a slot taken with acquire."""
+        self._semaphore.release()
+
+    def update(self, model: str, headers: Mapping[str, str]) -> None:
+        """Adapt to the remaining budget of a model reported in OpenAI's rate limit headers, including on 429s."""
+        delays = [parse_retry_after(headers)]
+        for limit, threshold in (("tokens", self.min_remaining_tokens), ("requests", 1)):
+            try:
+                remaining = int(headers.get(f"x-ratelimit-remaining-{limit}", ""))
+            except ValueError:
+                continue
+            if remaining < threshold:
+                # Hold new requests until the window resets instead of letting them fail with 429s
+                delays.append(parse_reset_duration(headers.get(f"x-ratelimit-reset-{limit}")))
+
+        delay = max(delays)
+        if delay > 0:
+            self._resume_at[model] = max(self._resume_at.get(model, 0.0), time.monotonic() + delay)
@@ -1,14 +1,158 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
 import os
-from typing import Dict, Literal, Optional, List, Any
+from types import MappingProxyType
+from typing import AsyncIterator, Dict, Final, Literal, Mapping, Optional, List, Any, Sequence, Tuple
 from pydantic import BaseModel
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI
+from tenacity import RetryCallState, retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from dotenv import load_dotenv
-import pandas as pd
-from hdbcli import dbapi
+import pyarrow as pa
+import anyio
+import httpx
+from hana_pool import HanaConnectionPool
+from query_cache import CachedResponse, RedisCache, ResponseCache, SemanticCache
+from rate_limit import OpenAIRateLimiter, parse_retry_after
+from sql_validation import validate_select
+from visualization import classify_visualization
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Shared across instances since the API creates a new assistant per request
+RESPONSE_CACHE = ResponseCache(maxsize=10_000, ttl=3600)
+SEMANTIC_CACHE = SemanticCache(threshold=0.92, maxsize=10_000)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Most questions are handled by the fast model; the stronger one only retries invalid SQL
+GENERATION_MODEL = os.getenv("OPENAI_MODEL") or "gpt-4o-mini"
+ESCALATION_MODEL = os.getenv("OPENAI_ESCALATION_MODEL") or "gpt-4o"
+
+# Output budgets for the fused completion; decode time grows linearly with output tokens
+MAX_SQL_TOKENS = 300
+MAX_SUMMARY_TOKENS = 64
+MAX_VISUALIZATION_TOKENS = 8
+# Room for the JSON keys, quotes and braces around the values
+JSON_OVERHEAD_TOKENS = 16
+
+# Retried by _call_openai; the SDK's built-in retries are disabled so this is the only retry policy
+RETRYABLE_OPENAI_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+OPENAI_BACKOFF = wait_random_exponential(multiplier=1, max=20)
+
+# Prefix the model uses to refuse write operations (see SAP_SYSTEM_PROMPT)
+REFUSAL_PREFIX = "ERROR:"
+
+# Rows fetched per round trip to HANA when materializing results
+FETCH_SIZE = int(os.getenv("SAP_HANA_FETCH_SIZE") or "1000")
+
+# Default LIMIT applied to generated SELECTs that do not bound their own result size
+MAX_ROWS = int(os.getenv("SAP_HANA_MAX_ROWS") or "10000")
+
+VISUALIZATION_TYPES = ("table", "bar_chart", "line_chart", "pie_chart")
+
+# Visualization is classified locally from keywords unless the model is asked to choose it
+LLM_VISUALIZATION = os.getenv("USE_LLM_VISUALIZATION", "").lower() in ("1", "true", "yes")
+
+# Static instructions sent as the system message. Keeping this prefix identical across
+# requests (and above 1024 tokens) lets OpenAI serve it from its prompt cache.
+SAP_SYSTEM_PROMPT: Final[str] = """\
+You are an assistant that converts business questions about SAP Business One data into valid \
+SAP HANA B1 SQL queries. For every question, write the SQL query and summarize what the \
+query will show.
+
+SQL requirements:
+1. Use proper SAP B1 table names and their documented relationships.
+2. Always include necessary JOINs between related tables (e.g., OINV with INV1, OCRD, etc.).
+3. Apply appropriate WHERE clauses based on user input or use-case.
+4. Use SAP HANA-specific SQL functions and syntax (e.g., TO_NVARCHAR(), CURRENT_DATE, ADD_MONTHS(), etc.).
+5. Optimize queries for performance — avoid unnecessary subqueries, use indexes where applicable.
+6. Always prefix all table names with the provided schema: {schema}
+7. Strictly enclose all identifiers (table names, column names) in double quotes to maintain case sensitivity.
+8. ❌ NEVER create procedures or queries that perform CREATE, DELETE, or INSERT operations.
+9. If asked to perform create, delete, or insert operations, use this as the SQL query:
+    ERROR: Operation not allowed. This assistant only supports read-only SELECT queries.
+10. If the query is related to cancelled journal entries, check the "JDT1" table and the "Closed" column.
+
+Table dictionary (all tables live in the "{schema}" schema):
+Sales
+- "OINV": Sales Invoices (A/R) - "DocEntry", "DocNum", "DocDate", "DocDueDate", "CardCode", "CardName", "DocTotal", "VatSum", "DiscSum", "DocCur", "SlpCode", "CANCELED", "DocStatus"
+- "INV1": Invoice Lines - "DocEntry", "LineNum", "ItemCode", "Dscription", "Quantity", "Price", "LineTotal", "WhsCode", "GrossBuyPr", "Project", "OcrCode"
+- "ORIN": Credit Memos (A/R) - same header columns as "OINV"
+- "RIN1": Credit Memo Lines - same line columns as "INV1"
+- "ORDR": Sales Orders, "RDR1": Sales Order Lines
+- "OQUT": Sales Quotations, "QUT1": Sales Quotation Lines
+- "ODLN": Deliveries, "DLN1": Delivery Lines
+- "ORDN": Returns, "RDN1": Return Lines
+- "ORCT": Incoming Payments - "DocEntry", "DocNum", "DocDate", "CardCode", "DocTotal", "Canceled"
+- "RCT2": Incoming Payment Invoices - "DocNum", "DocEntry", "InvType", "SumApplied"
+Purchasing
+- "OPOR": Purchase Orders, "POR1": Purchase Order Lines
+- "OPDN": Goods Receipt POs, "PDN1": Goods Receipt PO Lines
+- "OPCH": A/P Invoices, "PCH1": A/P Invoice Lines
+- "ORPC": A/P Credit Memos, "RPC1": A/P Credit Memo Lines
+- "OVPM": Outgoing Payments - "DocEntry", "DocNum", "DocDate", "CardCode", "DocTotal", "Canceled"
+Inventory
+- "OITM": Items - "ItemCode", "ItemName", "ItmsGrpCod", "FirmCode", "OnHand", "IsCommited", "OnOrder", "AvgPrice", "InvntItem", "SellItem", "PrchseItem", "validFor", "frozenFor"
+- "OITB": Brands - "ItmsGrpCod", "ItmsGrpNam"
+- "OITW": Warehouses - "ItemCode", "WhsCode", "OnHand", "IsCommited", "OnOrder", "MinStock", "MaxStock"
+- "OWHS": Warehouse Master Data - "WhsCode", "WhsName", "Location"
+- "OITC": Item Categories
+- "OITG": Item Groups - "ItmsTypCod", "ItmsGrpNam"
+- "OITL": Item Locations
+- "OMRC": Manufacturers - "FirmCode", "FirmName"
+- "OPLN": Price Lists - "ListNum", "ListName"
+- "ITM1": Item Prices - "ItemCode", "PriceList", "Price", "Currency"
+Business partners and people
+- "OCRD": Business Partners - "CardCode", "CardName", "CardType" ('C' customer, 'S' supplier, 'L' lead), "GroupCode", "Balance", "Currency", "SlpCode", "Country", "City", "validFor", "frozenFor"
+- "OCPR": Contact Persons - "CntctCode", "CardCode", "Name", "Tel1", "E_MailL"
+- "CRD1": Business Partner Addresses - "CardCode", "Address", "AdresType", "City", "Country"
+- "OCRG": Business Partner Groups - "GroupCode", "GroupName", "GroupType"
+- "OSLP": Sales Employees - "SlpCode", "SlpName"
+- "OHEM": Employees - "empID", "firstName", "lastName", "dept", "position", "salesPrson"
+Finance and projects
+- "OJDT": Journal Entries - "TransId", "RefDate", "DueDate", "Memo", "TransType", "BaseRef", "StornoToTr"
+- "JDT1": Journal Entry Lines - "TransId", "Line_ID", "Account", "ShortName", "Debit", "Credit", "RefDate", "Project", "ProfitCode", "Closed"
+- "OACT": G/L Accounts - "AcctCode", "AcctName", "GroupMask", "Postable", "CurrTotal", "FatherNum"
+- "OPRJ": Projects - "PrjCode", "PrjName", "Active"
+- "OPRC": Profit Centers - "PrcCode", "PrcName"
+
+Common relationships:
+- Document headers join their lines on "DocEntry" (e.g., "OINV"."DocEntry" = "INV1"."DocEntry").
+- Document headers join "OCRD" on "CardCode" and "OSLP" on "SlpCode".
+- Document lines join "OITM" on "ItemCode"; "OITM" joins "OITB" on "ItmsGrpCod" and "OMRC" on "FirmCode".
+- "JDT1" joins "OJDT" on "TransId" and "OACT" on "Account" = "AcctCode".
+- Exclude cancelled documents with "CANCELED" = 'N' unless cancelled documents are requested.
+- Net sales are invoice totals minus credit memo totals for the same period.
+
+{visualization_rules}The summary should:
+1. Be clear and non-technical
+2. Focus on business insights
+3. Be no more than 2 short sentences (under 40 words)
+
+Return only a JSON object with exactly these keys:
+{{"sqlQuery": "...",{visualization_key} "summary": "..."}}
+"""
+
+# Only sent when the model picks the visualization (USE_LLM_VISUALIZATION)
+VISUALIZATION_PROMPT: Final[str] = """Also choose the visualization type for the results from: table, bar_chart, line_chart, pie_chart
+1. Use line_chart for time periods, trends, growth or historical data
+   (words like 'trend', 'over time', 'history', 'growth').
+2. Use bar_chart for comparisons between categories, rankings, top/bottom items or
+   aggregations by category (words like 'top', 'bottom', 'compare', 'by category').
+3. Use pie_chart for proportions, percentages, distribution of a whole or market share
+   (words like 'distribution', 'percentage', 'share', 'proportion').
+4. Use table when detailed or raw data is needed, multiple dimensions are involved,
+   or there is no clear visualization preference.
+
+"""
+
 class QueryResponse(BaseModel):
     sqlQuery: str
     visualizationType: Literal["table", "bar_chart", "line_chart", "pie_chart"]
@@ -16,214 +160,360 @@ class QueryResponse(BaseModel):
     results: Optional[List[Dict[str, Any]]] = None
     error: Optional[str] = None
 
+@functools.cache
+def _system_prompt(schema: str) -> str:
+    """Return the system prompt for a schema, formatted once and reused by every request."""
+    # The question is sent verbatim as the user message, so braces in it never reach str.format
+    return SAP_SYSTEM_PROMPT.format(
+        schema=schema,
+        visualization_rules=VISUALIZATION_PROMPT if LLM_VISUALIZATION else "",
+        visualization_key=' "visualizationType": "...",' if LLM_VISUALIZATION else ""
+    )
+
+@functools.cache
+def _tenant_id(address: Optional[str], database: Optional[str], schema: str) -> str:
+    """Return a stable identifier for a tenant, used to route requests to the same OpenAI prompt cache."""
+    tenant = f"{address}/{database}/{schema}"
+    return hashlib.sha256(tenant.encode()).hexdigest()[:32]
+
+@functools.cache
+def _schema_tables(schema: str) -> Mapping[str, Tuple[str, ...]]:
+    """Return the common SAP B1 table mappings qualified with the given schema."""
+    def qualify(*tables: str) -> Tuple[str, ...]:
+        return tuple(f"{schema}.{table}" for table in tables)
+    
+    # Read-only view since the cached mapping is shared by every assistant instance
+    return MappingProxyType({
+        "sales": qualify("OINV", "INV1", "OITM", "ORIN", "RIN1"),
+        "inventory": qualify("OITM", "OITW", "OITB"),
+        "customers": qualify("OCRD", "OCPR"),
+        "purchases": qualify("OPOR", "POR1"),
+        "financial": qualify("OJDT", "JDT1"),
+        "brands": qualify("OITB"),
+        "item_categories": qualify("OITC"),
+        "item_groups": qualify("OITG"),
+        "item_locations": qualify("OITL"),
+        "items": qualify("OITM"),
+        "warehouses": qualify("OITW"),
+        "employees": qualify("OHEM"),
+        "projects": qualify("OPRJ"),
+        "journal_entries": qualify("OJDT"),
+        "journal_entry_lines": qualify("JDT1"),
+        "business_partners": qualify("OCRD"),
+    })
+
+def _arrow_column(values: Sequence[Any]) -> pa.Array:
+    """Build an Arrow array for one result column, falling back to strings for mixed types."""
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+def _openai_retry_wait(retry_state: RetryCallState) -> float:
+    """Wait as long as OpenAI's retry-after header asks, falling back to jittered exponential backoff."""
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    if response is not None:
+        delay = parse_retry_after(response.headers)
+        if delay > 0:
+            return delay
+    return OPENAI_BACKOFF(retry_state)
+
+def create_openai_client() -> AsyncOpenAI:
+    """Create an OpenAI client from environment configuration."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+    
+    # HTTP/2 multiplexes concurrent completions over a few pooled TLS connections
+    http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100)
+    )
+    # Retries are handled by SAPQueryAssistant._call_openai outside the rate limiter slot;
+    # the SDK's own retries would multiply attempts and back off while holding a slot
+    return AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+
 class SAPQueryAssistant:
-    def __init__(self):
-        """Initialize the SAP Query Assistant with OpenAI configuration."""
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        
-        self.client = OpenAI(api_key=self.api_key)
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        hana_pool: Optional[HanaConnectionPool] = None,
+        sql_cache: Optional[RedisCache] = None,
+        rate_limiter: Optional[OpenAIRateLimiter] = None
+    ):
+        """
+        Initialize the SAP Query Assistant with OpenAI configuration.
         
-        # Database connection parameters
-        self.db_params = {
-            "address": os.getenv("SAP_HANA_HOST"),
-            "port": int(os.getenv("SAP_HANA_PORT", "39015")),
-            "user": os.getenv("SAP_HANA_USER"),
-            "password": os.getenv("SAP_HANA_PASSWORD"),
-            "database": os.getenv("SAP_HANA_DATABASE")
-        }
+        Args:
+            client (AsyncOpenAI, optional): Shared OpenAI client; one is created from the environment if omitted
+            hana_pool (HanaConnectionPool, optional): Shared database connection pool; one is created from the environment if omitted
+            sql_cache (RedisCache, optional): Persistent cache of generated SQL shared across workers and restarts
+            rate_limiter (OpenAIRateLimiter, optional): Limiter shared by all requests; one is created from the environment if omitted
+        """
+        self.client = client or create_openai_client()
+        self.hana_pool = hana_pool or HanaConnectionPool.from_env()
+        self.sql_cache = sql_cache
+        self.rate_limiter = rate_limiter or OpenAIRateLimiter.from_env()
+        self.db_params = self.hana_pool.db_params
         
         # Get the schema name from environment or use default
         self.schema = os.getenv("SAP_B1_SCHEMA", "SBODEMOUS")
+        self.system_prompt = _system_prompt(self.schema)
         
-        # Common SAP B1 table mappings with schema
-        self.table_mappings = {
-            "sales": [f"{self.schema}.OINV", f"{self.schema}.INV1", f"{self.schema}.OITM", f"{self.schema}.ORIN", f"{self.schema}.RIN1"],
-            "inventory": [f"{self.schema}.OITM", f"{self.schema}.OITW", f"{self.schema}.OITB"],
-            "customers": [f"{self.schema}.OCRD", f"{self.schema}.OCPR"],
-            "purchases": [f"{self.schema}.OPOR", f"{self.schema}.POR1"],
-            "financial": [f"{self.schema}.OJDT", f"{self.schema}.JDT1"],
-            "brands": [f"{self.schema}.OITB"],
-            "item_categories": [f"{self.schema}.OITC"],
-            "item_groups": [f"{self.schema}.OITG"],
-            "item_locations": [f"{self.schema}.OITL"],
-            "items": [f"{self.schema}.OITM"],
-            "warehouses": [f"{self.schema}.OITW"],
-            "employees": [f"{self.schema}.OHEM"],
-            "customers": [f"{self.schema}.OCRD"],
-            "projects": [f"{self.schema}.OPRJ"],
-            "journal_entries": [f"{self.schema}.OJDT"],
-            "journal_entry_lines": [f"{self.schema}.JDT1"],
-            "business_partners": [f"{self.schema}.OCRD"],
-            "item_categories": [f"{self.schema}.OITC"],
-        }
+        self.max_tokens = MAX_SQL_TOKENS + MAX_SUMMARY_TOKENS + JSON_OVERHEAD_TOKENS
+        if LLM_VISUALIZATION:
+            self.max_tokens += MAX_VISUALIZATION_TOKENS
+        
+        # Stable per-tenant identifier so OpenAI routes requests to the same prompt cache
+        self.openai_user = _tenant_id(self.db_params["address"], self.db_params["database"], self.schema)
+        
+        # Common SAP B1 table mappings with schema (shared, built once per schema)
+        self.table_mappings = _schema_tables(self.schema)
 
-    def _get_db_connection(self):
-        """Create and return a database connection."""
+    def _fetch_rows(self, sql_query: str) -> Tuple[List[str], List[tuple]]:
+        """Execute the SQL query and return its column names and rows."""
         try:
-            conn = dbapi.connect(
-                address=self.db_params["address"],
-                port=self.db_params["port"],
-                user=self.db_params["user"],
-                password=self.db_params["password"],
-                database=self.db_params["database"]
-            )
-            return conn
+            # Reuse a pooled connection instead of paying a TCP/TLS/auth handshake per query
+            with self.hana_pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    # Fetch in large batches to cut round trips on long result sets
+                    cursor.arraysize = FETCH_SIZE
+                    if hasattr(cursor, "setfetchsize"):
+                        # hdbcli prefetches only a few rows per round trip by default
+                        cursor.setfetchsize(FETCH_SIZE)
+                    
+                    # Execute the query
+                    cursor.execute(sql_query)
+                    
+                    # Get column names
+                    columns = [desc[0] for desc in cursor.description]
+                    
+                    # Fetch all results
+                    rows = []
+                    while True:
+                        batch = cursor.fetchmany(FETCH_SIZE)
+                        if not batch:
+                            break
+                        rows.extend(batch)
+                finally:
+                    cursor.close()
+            
+            return columns, rows
         except Exception as e:
-            raise Exception(f"Failed to connect to SAP HANA database: {str(e)}")
+            raise Exception(f"Failed to execute query: {str(e)}")
 
     def _execute_query(self, sql_query: str) -> List[Dict[str, Any]]:
         """Execute the SQL query and return results as a list of dictionaries."""
-        try:
-            conn = self._get_db_connection()
-            cursor = conn.cursor()
-            
-            # Execute the query
-            cursor.execute(sql_query)
-            
-            # Get column names
-            columns = [desc[0] for desc in cursor.description]
-            
-            # Fetch all results
-            results = []
-            for row in cursor.fetchall():
-                results.append(dict(zip(columns, row)))
-            
-            cursor.close()
-            conn.close()
-            
-            return results
-        except Exception as e:
-            raise Exception(f"Failed to execute query: {str(e)}")
+        columns, rows = self._fetch_rows(sql_query)
+        
+        # A plain comprehension beats DataFrame.to_dict here: rows are already Python tuples of mixed types
+        return [dict(zip(columns, row)) for row in rows]
 
-    def _get_visualization_type(self, query: str) -> str:
-        """Determine the most appropriate visualization type based on the query."""
-        prompt = f"""
-        Based on the following business query, determine the most appropriate visualization type:
-        Query: {query}
+    def _execute_query_arrow(self, sql_query: str) -> pa.Table:
+        """Execute the SQL query and return results as a columnar Arrow table."""
+        columns, rows = self._fetch_rows(sql_query)
         
-        Choose from: table, bar_chart, line_chart, pie_chart
+        if not rows:
+            return pa.Table.from_arrays([pa.array([], type=pa.null()) for _ in columns], names=columns)
+        return pa.Table.from_arrays([_arrow_column(values) for values in zip(*rows)], names=columns)
+
+    def _prepare_sql(self, sql_query: str) -> str:
+        """Validate generated SQL locally so malformed or unsafe queries never reach HANA."""
+        if sql_query.startswith(REFUSAL_PREFIX):
+            raise ValueError(sql_query)
         
-        Consider these specific rules:
-        1. Use line_chart when the query mentions:
-           - Time periods (days, months, years)
-           - Trends, growth, or changes over time
-           - Historical data
-           - Words like 'trend', 'over time', 'history', 'growth'
+        return validate_select(sql_query, self.schema, MAX_ROWS)
+
+    async def _request_openai(self, resource: Any, hold_slot: bool = False, **params: Any) -> Any:
+        """
+        Make a single OpenAI call within the shared rate limit.
         
-        2. Use bar_chart when the query mentions:
-           - Comparisons between categories
-           - Rankings or top/bottom items
-           - Aggregations by category
-           - Words like 'top', 'bottom', 'compare', 'by category'
+        Args:
+            resource (Any): OpenAI resource whose create method is called
+            hold_slot (bool): Keep the rate limiter slot after returning; the caller must release it
+                once the response is consumed (used for streams)
+            **params: Parameters passed to create
+        """
+        model = params["model"]
+        await self.rate_limiter.acquire(model)
+        try:
+            raw = await resource.with_raw_response.create(**params)
+            self.rate_limiter.update(model, raw.headers)
+            response = raw.parse()
+        except openai.APIStatusError as e:
+            # 429s carry the rate limit and retry-after headers the limiter needs most
+            self.rate_limiter.update(model, e.response.headers)
+            self.rate_limiter.release()
+            raise
+        except BaseException:
+            self.rate_limiter.release()
+            raise
         
-        3. Use pie_chart when the query mentions:
-           - Proportions or percentages
-           - Distribution of a whole
-           - Market share
-           - Words like 'distribution', 'percentage', 'share', 'proportion'
+        if not hold_slot:
+            self.rate_limiter.release()
+        return response
+
+    @retry(
+        wait=_openai_retry_wait,
+        stop=stop_after_attempt(5),
+        retry=retry_if_exception_type(RETRYABLE_OPENAI_ERRORS),
+        reraise=True
+    )
+    async def _call_openai(self, resource: Any, hold_slot: bool = False, **params: Any) -> Any:
+        """Make an OpenAI call, retrying 429s and transient failures after retry-after or jittered exponential backoff."""
+        return await self._request_openai(resource, hold_slot=hold_slot, **params)
+
+    async def _embed_query(self, query: str) -> List[float]:
+        """Return the embedding of a natural language query for semantic caching."""
+        # A single attempt: the embedding only feeds the cache, and a failure is treated as a miss
+        response = await self._request_openai(
+            self.client.embeddings,
+            model=EMBEDDING_MODEL,
+            input=query.strip()
+        )
         
-        4. Use table when:
-           - Detailed data is needed
-           - Multiple dimensions are involved
-           - No clear visualization preference
-           - Raw data is requested
+        return response.data[0].embedding
+
+    def _completion_params(self, model: str) -> Dict[str, Any]:
+        """Return the chat completion parameters shared by the blocking and streaming calls."""
+        return {
+            "model": model,
+            "response_format": {"type": "json_object"},
+            # Deterministic output keeps generated SQL stable and cacheable
+            "temperature": 0.0,
+            "max_tokens": self.max_tokens,
+            "user": self.openai_user
+        }
+
+    def _messages(self, query: str) -> List[Dict[str, str]]:
+        """Build the chat messages; only the user message varies between requests."""
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": query}
+        ]
+
+    def _parse_completion(self, query: str, content: str) -> Tuple[str, str, str]:
+        """Extract the SQL query, visualization type and summary from a JSON completion."""
+        content = content.strip()
+        try:
+            payload = json.loads(content)
+            sql_query = str(payload["sqlQuery"]).strip()
+        except (ValueError, TypeError, KeyError):
+            # Treat a malformed reply as bare SQL and classify the visualization locally
+            return content, classify_visualization(query), ""
         
-        Return only the visualization type.
-        """
+        summary = str(payload.get("summary") or "").strip()
+        if not LLM_VISUALIZATION:
+            return sql_query, classify_visualization(query), summary
         
-        response = self.client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            max_tokens=50
+        viz_type = str(payload.get("visualizationType", "")).strip().lower()
+        return sql_query, viz_type if viz_type in VISUALIZATION_TYPES else classify_visualization(query), summary
+
+    async def _complete(self, query: str, model: str) -> Tuple[str, str, str]:
+        """Generate the SQL query, visualization type and summary in a single JSON-mode call."""
+        response = await self._call_openai(
+            self.client.chat.completions,
+            messages=self._messages(query),
+            **self._completion_params(model)
         )
         
-        viz_type = response.choices[0].message.content.strip().lower()
-        return viz_type if viz_type in ["table", "bar_chart", "line_chart", "pie_chart"] else "table"
-
-    def _generate_sql_query(self, query: str) -> str:
-        """Generate SAP HANA SQL query from natural language input."""
-        prompt = f"""
-            Convert the following business question into a valid SAP HANA B1 SQL query:
-            Question: {query}
-
-            Requirements:
-            1. Use proper SAP B1 table names and their documented relationships.
-            2. Always include necessary JOINs between related tables (e.g., OINV with INV1, OCRD, etc.).
-            3. Apply appropriate WHERE clauses based on user input or use-case.
-            4. Use SAP HANA-specific SQL functions and syntax (e.g., TO_NVARCHAR(), CURRENT_DATE, etc.).
-            5. Optimize queries for performance — avoid unnecessary subqueries, use indexes where applicable.
-            6. Always prefix all table names with the provided schema: {self.schema}
-            7. Strictly enclose all identifiers (table names, column names) in double quotes to maintain case sensitivity.
-            8. ❌ NEVER create procedures or queries that perform CREATE, DELETE, or INSERT operations.
-            9. If asked to perform create, delete, or insert operations, return the response:
-                ERROR: Operation not allowed. This assistant only supports read-only SELECT queries.
-            10. If the query is related to cancelled journal entries, check the "JDT1" table and the "Closed" column.
-
-
-            Common tables:
-            - "{self.schema}"."OINV": Sales Invoices
-            - "{self.schema}"."ORIN": Credit Memos
-            - "{self.schema}"."INV1": Invoice Lines
-            - "{self.schema}"."RIN1": Credit Memo Lines
-            - "{self.schema}"."OITM": Items
-            - "{self.schema}"."OCRD": Business Partners
-            - "{self.schema}"."OPRJ": Projects
-            - "{self.schema}"."OJDT": Journal Entries
-            - "{self.schema}"."OCRD": Business Partners
-            - "{self.schema}"."OITB": Brands
-            - "{self.schema}"."OITW": Warehouses
-            - "{self.schema}"."OITC": Item Categories
-            - "{self.schema}"."OITG": Item Groups
-            - "{self.schema}"."OITL": Item Locations
-            - "{self.schema}"."OITM": Items
-            - "{self.schema}"."OHEM": Employees
-            - "{self.schema}"."OPRJ": Projects
-            - "{self.schema}"."OJDT": Journal Entries
-            - "{self.schema}"."JDT1": Journal Entry Lines
-            - "{self.schema}"."OCRD": Business Partners
-            - "{self.schema}"."OITC": Item Categories
-
-            Return only the SQL query.
-            """
-        
-        response = self.client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            max_tokens=500
+        return self._parse_completion(query, response.choices[0].message.content)
+
+    async def _stream_complete(self, query: str, model: str) -> AsyncIterator[str]:
+        """Stream the raw JSON completion text as it is generated."""
+        stream = await self._call_openai(
+            self.client.chat.completions,
+            hold_slot=True,
+            messages=self._messages(query),
+            stream=True,
+            **self._completion_params(model)
         )
         
-        return response.choices[0].message.content.strip()
+        # The completion is still generating until the stream ends, so it keeps its slot until then
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            self.rate_limiter.release()
 
-    def _generate_summary(self, query: str, sql_query: str, results: Optional[List[Dict[str, Any]]] = None) -> str:
-        """Generate a human-readable summary of the query results."""
-        prompt = f"""
-        Create a concise, business-friendly summary of what the following SQL query will show:
-        Query: {sql_query}
+    def _is_usable_sql(self, sql_query: str) -> bool:
+        """Return True if generated SQL is a refusal or passes the local validation gate."""
+        if sql_query.startswith(REFUSAL_PREFIX):
+            return True
+        try:
+            validate_select(sql_query, self.schema)
+        except ValueError:
+            return False
+        return True
+
+    def _needs_escalation(self, sql_query: str) -> bool:
+        """Return True if the generated SQL is neither a refusal nor a query that passes validation."""
+        # The same gate as execution, so SQL against the wrong schema is retried rather than failing later
+        return not self._is_usable_sql(sql_query)
+
+    async def _generate_all(self, query: str) -> Tuple[str, str, str]:
+        """Generate with the fast model, escalating to the stronger one if its SQL is unusable."""
+        generated = await self._complete(query, GENERATION_MODEL)
+        if not self._needs_escalation(generated[0]):
+            return generated
         
-        Original question: {query}
+        return await self._complete(query, ESCALATION_MODEL)
+
+    async def _lookup_cached(self, query: str, execute_query: bool) -> Tuple[str, Optional[List[float]], Optional[CachedResponse]]:
+        """Look up previously generated artifacts, returning the cache key and query embedding for storing a miss."""
+        # Reuse previously generated artifacts for repeated questions
+        cache_key = ResponseCache.make_key(query, execute_query, self.schema)
+        cached = RESPONSE_CACHE.get(cache_key)
         
-        The summary should:
-        1. Be clear and non-technical
-        2. Focus on business insights
-        3. Be no more than 2 sentences
+        # Then the persistent cache, which also catches differences in case, spacing and punctuation
+        if cached is None and self.sql_cache is not None:
+            cached = await self.sql_cache.get(RedisCache.make_key(query, self.schema, GENERATION_MODEL))
+            if cached is not None:
+                RESPONSE_CACHE.set(cache_key, cached)
         
-        Return only the summary.
-        """
+        # Fall back to paraphrase matching, which costs one embedding call
+        embedding = None
+        if cached is None:
+            try:
+                embedding = await self._embed_query(query)
+            except openai.OpenAIError as e:
+                # The cache is an optimization; never fail a request because the embedding call failed
+                logger.warning("Semantic cache lookup failed: %s", e)
+            else:
+                cached = SEMANTIC_CACHE.lookup(self.schema, query, embedding)
+            # Semantic hits stay out of Redis: a false positive would become an exact hit in every worker for a day
+            if cached is not None:
+                RESPONSE_CACHE.set(cache_key, cached)
         
-        response = self.client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=100
-        )
+        return cache_key, embedding, cached
+
+    async def _store_cached(self, query: str, cache_key: str, embedding: Optional[List[float]], generated: CachedResponse) -> None:
+        """Store freshly generated artifacts in the exact, persistent and semantic caches."""
+        # Unusable SQL would be served again for a day instead of being regenerated
+        if not self._is_usable_sql(generated[0]):
+            return
         
-        return response.choices[0].message.content.strip()
+        RESPONSE_CACHE.set(cache_key, generated)
+        if embedding is not None:
+            SEMANTIC_CACHE.add(self.schema, query, embedding, generated)
+        if self.sql_cache is not None:
+            await self.sql_cache.set(RedisCache.make_key(query, self.schema, GENERATION_MODEL), generated)
 
-    def process_query(self, query: str, execute_query: bool = True) -> QueryResponse:
+    async def _get_artifacts(self, query: str, execute_query: bool) -> CachedResponse:
+        """Return the SQL query, visualization type and summary, from cache when possible."""
+        cache_key, embedding, cached = await self._lookup_cached(query, execute_query)
+        if cached is not None:
+            return cached
+        
+        # Generate SQL query, visualization type and summary in one round trip
+        generated = await self._generate_all(query)
+        await self._store_cached(query, cache_key, embedding, generated)
+        return generated
+
+    async def process_query(self, query: str, execute_query: bool = True) -> QueryResponse:
         """
         Process a natural language query and return structured response.
         
@@ -235,24 +525,19 @@ class SAPQueryAssistant:
             QueryResponse: Structured response containing SQL query, visualization type, summary, and results
         """
         try:
-            # Generate SQL query
-            sql_query = self._generate_sql_query(query)
-            
-            # Determine visualization type
-            viz_type = self._get_visualization_type(query)
+            sql_query, viz_type, summary = await self._get_artifacts(query, execute_query)
             
-            # Execute query if requested
+            # Execute query if requested (results are always fetched fresh)
             results = None
             error = None
             if execute_query:
                 try:
-                    results = self._execute_query(sql_query)
+                    safe_sql = self._prepare_sql(sql_query)
+                    # hdbcli is blocking, so keep it off the event loop
+                    results = await anyio.to_thread.run_sync(self._execute_query, safe_sql)
                 except Exception as e:
                     error = str(e)
             
-            # Generate summary
-            summary = self._generate_summary(query, sql_query, results)
-            
             return QueryResponse(
                 sqlQuery=sql_query,
                 visualizationType=viz_type,
@@ -264,8 +549,87 @@ class SAPQueryAssistant:
         except Exception as e:
             raise Exception(f"Error processing query: {str(e)}")
 
+    async def process_query_arrow(self, query: str) -> Tuple[QueryResponse, Optional[pa.Table]]:
+        """
+        Process a natural language query, returning the results as a columnar Arrow table.
+        
+        Args:
+            query (str): Natural language business query
+            
+        Returns:
+            Tuple[QueryResponse, Optional[pa.Table]]: Response without row results, and the results table
+            (None if execution failed, see the response error)
+        """
+        try:
+            sql_query, viz_type, summary = await self._get_artifacts(query, True)
+            
+            table = None
+            error = None
+            try:
+                safe_sql = self._prepare_sql(sql_query)
+                table = await anyio.to_thread.run_sync(self._execute_query_arrow, safe_sql)
+            except Exception as e:
+                error = str(e)
+            
+            response = QueryResponse(
+                sqlQuery=sql_query,
+                visualizationType=viz_type,
+                summary=summary,
+                error=error
+            )
+            return response, table
+            
+        except Exception as e:
+            raise Exception(f"Error processing query: {str(e)}")
+
+    async def stream_query(self, query: str, execute_query: bool = True) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Process a natural language query, yielding each part of the response as soon as it is available.
+        
+        Args:
+            query (str): Natural language business query
+            execute_query (bool): Whether to execute the query and return results
+            
+        Yields:
+            Tuple[str, Any]: (event, data) pairs; "token" events carry raw completion text while it is
+            generated, followed by "sql", "visualization", "summary", then "results" or "error", and "done".
+            A "reset" event means the streamed tokens were discarded because their SQL escalated to the
+            stronger model
+        """
+        cache_key, embedding, cached = await self._lookup_cached(query, execute_query)
+        
+        if cached is not None:
+            sql_query, viz_type, summary = cached
+        else:
+            chunks = []
+            async for token in self._stream_complete(query, GENERATION_MODEL):
+                chunks.append(token)
+                yield "token", token
+            
+            sql_query, viz_type, summary = self._parse_completion(query, "".join(chunks))
+            if self._needs_escalation(sql_query):
+                # Tell the client to drop the tokens it rendered before the replacement fields arrive
+                yield "reset", ESCALATION_MODEL
+                sql_query, viz_type, summary = await self._complete(query, ESCALATION_MODEL)
+            await self._store_cached(query, cache_key, embedding, (sql_query, viz_type, summary))
+        
+        # Let the client render the SQL and summary while HANA is still running
+        yield "sql", sql_query
+        yield "visualization", viz_type
+        yield "summary", summary
+        
+        if execute_query:
+            try:
+                safe_sql = self._prepare_sql(sql_query)
+                results = await anyio.to_thread.run_sync(self._execute_query, safe_sql)
+                yield "results", results
+            except Exception as e:
+                yield "error", str(e)
+        
+        yield "done", None
+
 # Example usage
 if __name__ == "__main__":
     assistant = SAPQueryAssistant()
-    result = assistant.process_query("Show me the top 5 selling products in the last 3 months")
+    result = asyncio.run(assistant.process_query("Show me the top 5 selling products in the last 3 months"))
     print(result.json(indent=2))
\ No newline at end of file
@@ -0,0 +1,93 @@
+from typing import Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+# Statement types that can only read data
+READ_ONLY_STATEMENTS = (exp.Select, exp.Union, exp.Intersect, exp.Except)
+
+# Nodes that write data or change the schema, wherever they appear in the tree
+# (names differ slightly between sqlglot releases, so only the available ones are used)
+FORBIDDEN_NODES = tuple(
+    getattr(exp, name)
+    for name in ("Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "AlterTable", "TruncateTable", "Into", "Command")
+    if hasattr(exp, name)
+)
+
+# sqlglot has no HANA dialect. Snowflake's is the closest match: it accepts both TOP and LIMIT
+# (the default dialect rejects SELECT TOP, so every "top N" answer would escalate),
+# treats double quotes as identifiers and folds unquoted identifiers to upper case like HANA.
+READ_DIALECT = "snowflake"
+
+# HANA's built-in single-row table, valid without a schema prefix
+DUMMY_TABLE = "DUMMY"
+
+
+def _parse_single(statement: str) -> Optional[exp.Expression]:
+    """Parse a single statement, returning None if it is not exactly one parseable statement."""
+    try:
+        expressions = sqlglot.parse(statement, read=READ_DIALECT)
+    except SqlglotError:
+        return None
+
+    if len(expressions) != 1:
+        return None
+    return expressions[0]
+
+
+def _is_schema(identifier: exp.Identifier, schema: str) -> bool:
+    """Return True if a schema identifier names the given schema under HANA's identifier rules."""
+    # Quoted identifiers are case-sensitive; unquoted ones are folded to upper case
+    if identifier.quoted:
+        return identifier.name == schema
+    return identifier.name.upper() == schema
+
+
+def validate_select(sql_query: str, schema: str, max_rows: int = 0) -> str:
+    """
+    Check generated SQL locally before it is sent to SAP HANA.
+
+    Args:
+        sql_query (str): Generated SQL query
+        schema (str): The only schema the query may read from
+        max_rows (int): LIMIT added to a query without one; 0 disables the default
+
+    Returns:
+        str: The statement to execute
+
+    Raises:
+        ValueError: If the SQL is not a single read-only query against the schema
+    """
+    statement = sql_query.strip().rstrip(";").strip()
+    expression = _parse_single(statement)
+    if expression is None:
+        raise ValueError("Query rejected: generated SQL is not a single valid statement")
+
+    if not isinstance(expression, READ_ONLY_STATEMENTS):
+        raise ValueError("Query rejected: only read-only SELECT queries are allowed")
+
+    forbidden = expression.find(*FORBIDDEN_NODES)
+    if forbidden is not None:
+        raise ValueError(f"Query rejected: {forbidden.key.upper()} operations are not allowed")
+
+    # SELECT ... FOR UPDATE takes row locks on the ERP tables
+    if any(select.args.get("locks") for select in expression.find_all(exp.Select)):
+        raise ValueError("Query rejected: locking clauses such as FOR UPDATE are not allowed")
+
+    cte_names = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+    for table in expression.find_all(exp.Table):
+        if table.catalog:
+            raise ValueError(f"Query rejected: database \"{table.catalog}\" is not allowed, use \"{schema}\"")
+        if table.db:
+            if not _is_schema(table.args["db"], schema):
+                raise ValueError(f"Query rejected: schema \"{table.db}\" is not allowed, use \"{schema}\"")
+        elif table.name and table.name not in cte_names and table.name.upper() != DUMMY_TABLE:
+            raise ValueError(f"Query rejected: table \"{table.name}\" must be prefixed with schema \"{schema}\"")
+
+    # TOP, LIMIT and FETCH FIRST all parse into the "limit" argument. A trailing LIMIT belongs to the
+    # set operation itself (UNION, INTERSECT, EXCEPT), so it bounds the combined result.
+    if max_rows and not expression.args.get("limit"):
+        statement = f"{statement}\nLIMIT {max_rows}"
+
+    return statement
@@ -0,0 +1,87 @@
+import pytest
+
+import hana_pool
+from hana_pool import HanaConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, statement):
+        if not self.conn.alive:
+            raise RuntimeError("connection lost")
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+
+    def connect(**params):
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(hana_pool.dbapi, "connect", connect)
+    return opened
+
+
+def test_reuses_released_connection(connections):
+    pool = HanaConnectionPool({}, maxsize=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert len(connections) == 1
+
+
+def test_times_out_when_exhausted(connections):
+    pool = HanaConnectionPool({}, maxsize=1, timeout=0.01)
+    pool.acquire()
+
+    with pytest.raises(Exception, match="Timed out"):
+        pool.acquire()
+
+
+def test_replaces_dead_connection(connections):
+    pool = HanaConnectionPool({}, maxsize=1)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.alive = False
+
+    replacement = pool.acquire()
+
+    assert replacement is not conn
+    assert conn.closed
+
+
+def test_close_discards_idle_and_released_connections(connections):
+    pool = HanaConnectionPool({}, maxsize=2)
+    idle = pool.acquire()
+    busy = pool.acquire()
+    pool.release(idle)
+
+    pool.close()
+    pool.release(busy)
+
+    assert idle.closed and busy.closed
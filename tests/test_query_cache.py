@@ -0,0 +1,58 @@
+import numpy as np
+
+from query_cache import RedisCache, SemanticCache, normalize_query, query_literals
+
+ARTIFACTS = ("SELECT 1 FROM DUMMY", "table", "")
+
+
+def test_query_literals_keeps_numbers_codes_and_quoted_strings():
+    assert query_literals("Top 5 invoices for C001 in 'WH01'") == ("top", "5", "C001", "'WH01'")
+
+
+def test_query_literals_includes_number_and_direction_words():
+    assert query_literals("Top five customers") == ("top", "five")
+    assert query_literals("bottom ten customers") == ("bottom", "ten")
+    assert query_literals("sales this year") != query_literals("sales last year")
+
+
+def test_semantic_cache_matches_paraphrases_with_the_same_literals():
+    cache = SemanticCache(threshold=0.9)
+    vector = np.ones(8)
+    cache.add("SBODEMOUS", "top five customers", vector, ARTIFACTS)
+
+    assert cache.lookup("SBODEMOUS", "Top five customers please", vector) == ARTIFACTS
+    assert cache.lookup("SBODEMOUS", "top ten customers", vector) is None
+    assert cache.lookup("OTHER", "top five customers", vector) is None
+
+
+def test_semantic_cache_evicts_oldest_entry_when_full():
+    cache = SemanticCache(threshold=0.9, maxsize=2)
+    vector = np.ones(8)
+    cache.add("SBODEMOUS", "top 1 items", vector, ARTIFACTS)
+    cache.add("SBODEMOUS", "top 2 items", vector, ARTIFACTS)
+    cache.add("SBODEMOUS", "top 3 items", vector, ARTIFACTS)
+
+    assert cache.lookup("SBODEMOUS", "top 1 items", vector) is None
+    assert cache.lookup("SBODEMOUS", "top 3 items", vector) == ARTIFACTS
+
+
+def test_normalize_query_ignores_case_spacing_and_sentence_punctuation():
+    assert normalize_query("  Sales, by BRAND? ") == normalize_query("sales by brand.")
+
+
+def test_normalize_query_keeps_operators_signs_and_percent():
+    assert normalize_query("customers with balance > 1000") != normalize_query("customers with balance < 1000")
+    assert normalize_query("growth of -5%") != normalize_query("growth of 5%")
+    assert normalize_query("items priced 1.5 or more") != normalize_query("items priced 15 or more")
+
+
+def test_normalize_query_keeps_quoted_literals_verbatim():
+    assert normalize_query("Invoices for 'Acme'") == "invoices for 'Acme'"
+
+
+def test_redis_key_depends_on_schema_and_model():
+    key = RedisCache.make_key("top 5 customers", "SBODEMOUS", "gpt-4o-mini")
+
+    assert key == RedisCache.make_key("Top 5 customers?", "SBODEMOUS", "gpt-4o-mini")
+    assert key != RedisCache.make_key("top 5 customers", "OTHER", "gpt-4o-mini")
+    assert key != RedisCache.make_key("top 5 customers", "SBODEMOUS", "gpt-4o")
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_limit import OpenAIRateLimiter, parse_reset_duration, parse_retry_after
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("20ms", 0.02),
+    ("1s", 1.0),
+    ("6m0s", 360.0),
+    ("1h2m3.5s", 3723.5),
+    ("", 0.0),
+    (None, 0.0),
+])
+def test_parse_reset_duration(value, expected):
+    assert parse_reset_duration(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "250"}, 0.25),
+    ({"retry-after": "2"}, 2.0),
+    ({"retry-after-ms": "250", "retry-after": "2"}, 0.25),
+    ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, 0.0),
+    ({}, 0.0),
+])
+def test_parse_retry_after(headers, expected):
+    assert parse_retry_after(headers) == pytest.approx(expected)
+
+
+def test_update_pauses_only_the_drained_model():
+    limiter = OpenAIRateLimiter(min_remaining_tokens=100)
+    limiter.update("gpt-4o", {"x-ratelimit-remaining-tokens": "5", "x-ratelimit-reset-tokens": "200ms"})
+
+    async def timed_acquire(model):
+        start = time.monotonic()
+        await limiter.acquire(model)
+        limiter.release()
+        return time.monotonic() - start
+
+    assert asyncio.run(timed_acquire("gpt-4o-mini")) < 0.1
+    assert asyncio.run(timed_acquire("gpt-4o")) >= 0.15
+
+
+def test_update_pauses_on_retry_after_and_exhausted_requests():
+    limiter = OpenAIRateLimiter()
+    limiter.update("a", {"retry-after-ms": "5000"})
+    limiter.update("b", {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "3s"})
+    limiter.update("c", {"x-ratelimit-remaining-tokens": "100000", "x-ratelimit-remaining-requests": "50"})
+
+    now = time.monotonic()
+    assert limiter._resume_at["a"] - now == pytest.approx(5.0, abs=0.5)
+    assert limiter._resume_at["b"] - now == pytest.approx(3.0, abs=0.5)
+    assert "c" not in limiter._resume_at
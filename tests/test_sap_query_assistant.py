@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from rate_limit import OpenAIRateLimiter
+from sap_query_assistant import SAPQueryAssistant
+
+RATE_LIMIT_HEADERS = {
+    "retry-after-ms": "10",
+    "x-ratelimit-remaining-tokens": "0",
+    "x-ratelimit-reset-tokens": "10ms",
+}
+
+
+def rate_limit_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    response = httpx.Response(429, headers=RATE_LIMIT_HEADERS, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class FakeResource:
+    """OpenAI resource whose create fails with 429s a given number of times before succeeding."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+        self.with_raw_response = self
+
+    async def create(self, **params):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise rate_limit_error()
+        return SimpleNamespace(headers={}, parse=lambda: "parsed")
+
+
+@pytest.fixture
+def assistant():
+    pool = SimpleNamespace(db_params={"address": "hana", "database": "DB"})
+    return SAPQueryAssistant(client=object(), hana_pool=pool, rate_limiter=OpenAIRateLimiter(max_concurrency=1))
+
+
+def test_call_openai_retries_429s_and_pauses_the_model(assistant):
+    resource = FakeResource(failures=2)
+
+    assert asyncio.run(assistant._call_openai(resource, model="gpt-4o-mini")) == "parsed"
+    assert resource.calls == 3
+    assert "gpt-4o-mini" in assistant.rate_limiter._resume_at
+
+
+def test_call_openai_gives_up_after_five_attempts(assistant):
+    resource = FakeResource(failures=10)
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(assistant._call_openai(resource, model="gpt-4o-mini"))
+    assert resource.calls == 5
+
+
+def test_embedding_lookup_fails_fast(assistant):
+    resource = FakeResource(failures=10)
+    assistant.client = SimpleNamespace(embeddings=resource)
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(assistant._embed_query("top 5 customers"))
+    assert resource.calls == 1
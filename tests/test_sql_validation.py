@@ -0,0 +1,69 @@
+import pytest
+
+from sql_validation import validate_select
+
+SCHEMA = "SBODEMOUS"
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT TOP 5 "ItemCode" FROM "SBODEMOUS"."OITM" ORDER BY "OnHand" DESC',
+    'SELECT T0."DocNum" FROM SBODEMOUS.OINV T0 INNER JOIN SBODEMOUS.INV1 T1 ON T0."DocEntry" = T1."DocEntry" LIMIT 10',
+    'SELECT "CardCode" FROM sbodemous.OCRD LIMIT 10',
+    'WITH recent AS (SELECT "DocEntry" FROM "SBODEMOUS"."OINV") SELECT * FROM recent LIMIT 10',
+    "SELECT CURRENT_DATE FROM DUMMY LIMIT 1",
+    'SELECT "DocNum" FROM "SBODEMOUS"."OINV" WHERE "CardCode" IN (SELECT "CardCode" FROM "SBODEMOUS"."OCRD") LIMIT 10',
+])
+def test_accepts_read_only_queries_against_the_schema(sql):
+    assert validate_select(sql, SCHEMA, max_rows=100) == sql
+
+
+def test_strips_trailing_semicolon():
+    assert validate_select('SELECT TOP 1 * FROM "SBODEMOUS"."OINV";', SCHEMA) == 'SELECT TOP 1 * FROM "SBODEMOUS"."OINV"'
+
+
+@pytest.mark.parametrize("sql, message", [
+    ('DELETE FROM "SBODEMOUS"."OINV"', "read-only"),
+    ('UPDATE "SBODEMOUS"."OCRD" SET "Balance" = 0', "read-only"),
+    ('INSERT INTO "SBODEMOUS"."OCRD" SELECT * FROM "SBODEMOUS"."OCRD"', "read-only"),
+    ('DROP TABLE "SBODEMOUS"."OINV"', "read-only"),
+    ('SELECT * INTO "SBODEMOUS"."COPY" FROM "SBODEMOUS"."OINV"', "not allowed"),
+    ('SELECT 1 FROM DUMMY; DELETE FROM "SBODEMOUS"."OINV"', "single valid statement"),
+    ("SELECT FROM WHERE", "single valid statement"),
+    ("ERROR: Operation not allowed.", "single valid statement"),
+    ('SELECT * FROM "SBODEMOUS"."OINV" FOR UPDATE', "FOR UPDATE"),
+    ('SELECT * FROM "SBODEMOUS"."OINV" UNION SELECT * FROM "SBODEMOUS"."ORIN" FOR UPDATE', "FOR UPDATE"),
+    ('SELECT * FROM "OTHER"."OINV"', 'schema "OTHER"'),
+    ('SELECT * FROM "sbodemous"."OCRD"', 'schema "sbodemous"'),
+    ('SELECT * FROM OTHERDB.SBODEMOUS.OINV', 'database "OTHERDB"'),
+    ('SELECT * FROM "OINV"', "must be prefixed"),
+    ('SELECT * FROM "SBODEMOUS"."OINV" WHERE "CardCode" IN (SELECT "CardCode" FROM "OCRD")', "must be prefixed"),
+])
+def test_rejects_unsafe_or_foreign_queries(sql, message):
+    with pytest.raises(ValueError, match=message):
+        validate_select(sql, SCHEMA)
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT * FROM "SBODEMOUS"."OINV"',
+    'WITH t AS (SELECT 1 AS "A" FROM DUMMY) SELECT * FROM t',
+    'SELECT "CardCode" FROM "SBODEMOUS"."OINV" UNION ALL SELECT "CardCode" FROM "SBODEMOUS"."ORIN"',
+    'SELECT "CardCode" FROM "SBODEMOUS"."OINV" INTERSECT SELECT "CardCode" FROM "SBODEMOUS"."ORIN"',
+    'SELECT "CardCode" FROM "SBODEMOUS"."OINV" EXCEPT SELECT "CardCode" FROM "SBODEMOUS"."ORIN"',
+])
+def test_adds_default_limit_to_unbounded_queries(sql):
+    assert validate_select(sql, SCHEMA, max_rows=100) == f"{sql}\nLIMIT 100"
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT TOP 5 * FROM "SBODEMOUS"."OINV"',
+    'SELECT * FROM "SBODEMOUS"."OINV" LIMIT 5',
+    'SELECT * FROM "SBODEMOUS"."OINV" FETCH FIRST 5 ROWS ONLY',
+    'SELECT "CardCode" FROM "SBODEMOUS"."OINV" UNION SELECT "CardCode" FROM "SBODEMOUS"."ORIN" LIMIT 5',
+])
+def test_keeps_existing_row_bound(sql):
+    assert validate_select(sql, SCHEMA, max_rows=100) == sql
+
+
+def test_default_limit_can_be_disabled():
+    sql = 'SELECT * FROM "SBODEMOUS"."OINV"'
+    assert validate_select(sql, SCHEMA, max_rows=0) == sql
@@ -0,0 +1,23 @@
+import pytest
+
+from visualization import classify_visualization
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Sales distribution by brand", "pie_chart"),
+    ("What percentage of invoices are overdue?", "pie_chart"),
+    ("Monthly sales trend for 2024", "line_chart"),
+    ("Revenue per month", "line_chart"),
+    ("Top 5 customers by revenue", "bar_chart"),
+    ("Most sold items last quarter", "bar_chart"),
+    ("Compare sales by warehouse", "bar_chart"),
+    ("Show most recent 10 invoices", "table"),
+    ("Invoices with > 50% discount", "table"),
+    ("List open sales orders", "table"),
+])
+def test_classify_visualization(query, expected):
+    assert classify_visualization(query) == expected
+
+
+def test_pie_chart_takes_precedence_over_line_chart():
+    assert classify_visualization("Monthly share of sales by region") == "pie_chart"
@@ -0,0 +1,31 @@
+import re
+from typing import List, Pattern, Tuple
+
+# Keyword rules mirroring the visualization guidance in the system prompt, checked in
+# precedence order: pie_chart > line_chart > bar_chart, falling back to table.
+_VISUALIZATION_PATTERNS: List[Tuple[str, Pattern[str]]] = [
+    ("pie_chart", re.compile(
+        r"\b(distribution|percentages?|percent|share|proportions?|breakdown)\b",
+        re.IGNORECASE
+    )),
+    ("line_chart", re.compile(
+        r"\b(trends?|over time|history|historical|growth|daily|weekly|monthly|quarterly|yearly|annual"
+        r"|(per|by|each) (day|week|month|quarter|year))\b",
+        re.IGNORECASE
+    )),
+    ("bar_chart", re.compile(
+        r"\b(top|bottom|best|worst|highest|lowest|rank|ranking|compare|comparison|versus|vs"
+        # "most recent" is a plain listing, so most/least only count in a ranking context
+        r"|(most|least) (sold|ordered|purchased|bought|popular|profitable|valuable|expensive)"
+        r"|by category|by (customer|item|product|brand|group|warehouse|region|country|employee|project))\b",
+        re.IGNORECASE
+    )),
+]
+
+
+def classify_visualization(query: str) -> str:
+    """Determine the most appropriate visualization type from keywords in the query."""
+    for viz_type, pattern in _VISUALIZATION_PATTERNS:
+        if pattern.search(query):
+            return viz_type
+    return "table"